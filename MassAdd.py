@@ -4,16 +4,31 @@
 # Updated for Anki 25.02.5
 #
 
+import os
+import re
+import unicodedata
+
 from aqt import mw, deckchooser, notetypechooser
+from anki.collection import AddNoteRequest
+from anki.consts import MODEL_CLOZE
 from anki.models import NotetypeId
 from anki.notes import Note, NoteId
-from aqt.utils import showInfo
-from aqt.qt import QDialog, QVBoxLayout, QHBoxLayout, QWidget, QTextEdit, QPushButton, QLabel, QLineEdit, QAction
+from anki.utils import field_checksum, ids2str, split_fields, strip_html_media
+from aqt.utils import showInfo, tooltip
+from aqt.qt import QDialog, QVBoxLayout, QHBoxLayout, QWidget, QTextEdit, QPushButton, QLabel, QLineEdit, QAction, QCheckBox, QTimer
 from aqt.browser import Browser
-from aqt.gui_hooks import browser_will_show
+from aqt.operations import CollectionOp
+from aqt.gui_hooks import browser_will_show, profile_will_close
 from aqt.tagedit import TagEdit
 from PyQt6.QtCore import Qt
-from typing import List
+from typing import Dict, List
+
+from .draft_store import DraftStore
+
+USER_FILES_DIR = os.path.join(os.path.dirname(__file__), "user_files")
+
+# Wait for typing to pause this long before saving the draft
+DRAFT_SAVE_DELAY_MS = 2000
 
 
 def gc(key, default=None):
@@ -24,6 +39,51 @@ def gc(key, default=None):
     return conf.get(key, default)
 
 
+def cloze_field_indices(m) -> List[int]:
+    """Indices of the fields a cloze note type's template uses with {{cloze:...}}"""
+    if m["type"] != MODEL_CLOZE:
+        return []
+    names = set()
+    for template in m["tmpls"]:
+        for reference in re.findall(r"\{\{cloze:([^}]+)\}\}", template["qfmt"]):
+            # Filters may be chained, the field name comes last
+            names.add(reference.split(":")[-1].strip())
+    return [i for i, fld in enumerate(m["flds"]) if fld["name"] in names]
+
+
+def first_field_key(value: str) -> str:
+    """Comparison key for a first field: NFC-normalized, HTML stripped"""
+    return strip_html_media(unicodedata.normalize("NFC", value)).strip()
+
+
+def find_notes_by_first_field(notetype_id, first_fields) -> Dict[str, NoteId]:
+    """Map first-field keys to existing note ids of a note type with one query.
+
+    Matching works like Anki's duplicate check: candidates are narrowed by the
+    checksum Anki stores for the NFC-normalized first field, then compared by
+    first_field_key().
+    """
+    normalized = {unicodedata.normalize("NFC", value) for value in first_fields if value}
+    wanted = {first_field_key(value) for value in normalized}
+    wanted.discard("")
+    if not wanted:
+        return {}
+
+    checksums = {field_checksum(value) for value in normalized}
+    rows = mw.col.db.all(
+        f"SELECT id, flds FROM notes WHERE mid = ? AND csum IN {ids2str(checksums)} ORDER BY id",
+        notetype_id,
+    )
+
+    found: Dict[str, NoteId] = {}
+    for nid, flds in rows:
+        key = first_field_key(split_fields(flds)[0])
+        # Keep the oldest note if the collection already has duplicates
+        if key in wanted and key not in found:
+            found[key] = NoteId(nid)
+    return found
+
+
 class MockEditor:
     """Mock editor to satisfy Quick Access addon requirements"""
     def __init__(self, parent):
@@ -104,12 +164,19 @@ class MassAddWindow(QDialog):
         self.processor_text = None
         self.processor_button = None
         self.submit_button = None
+        self.check_button = None
         self.deck_chooser = None
         self.model_chooser = None
         self.notetype_chooser = None  # Alias for compatibility
         self.editor = None  # Will be initialized in setup_ui
         self.mw = mw  # Reference to main window
         self.tags_edit = None  # Tag field
+        self.upsert_checkbox = None
+        self.dictionary_checkbox = None
+        self.dictionary = None  # Open dictionary index, kept between runs
+        self.save_draft_enabled = False
+        self.draft_store = DraftStore(USER_FILES_DIR)
+        self.draft_timer = None
 
     def setup_ui(self):
         layout = QVBoxLayout()
@@ -117,6 +184,7 @@ class MassAddWindow(QDialog):
         self.model_widget = QWidget(self)
         self.text_edit = QTextEdit(self)
         self.submit_button = QPushButton(self)
+        self.check_button = QPushButton(self)
 
         # Create mock editor for Quick Access addon compatibility
         self.editor = MockEditor(self)
@@ -182,13 +250,44 @@ class MassAddWindow(QDialog):
         self.submit_button.setText("Add")
         self.submit_button.clicked.connect(self.add_current_sentences)
 
+        self.check_button.setText("Check")
+        self.check_button.setToolTip("Check the notes for problems without adding them")
+        self.check_button.clicked.connect(self.check_current_sentences)
+
+        self.upsert_checkbox = QCheckBox("Update existing", self)
+        self.upsert_checkbox.setToolTip(
+            "Update notes of this note type whose first field matches a line "
+            "instead of adding duplicates.\nEmpty columns keep the existing field content."
+        )
+
+        self.dictionary_checkbox = QCheckBox("Fill from dictionary", self)
+        self.dictionary_checkbox.setToolTip(
+            "Fill empty fields by looking up the first field in the dictionary "
+            "set in the MassAdd configuration"
+        )
+        self.dictionary_checkbox.setChecked(bool(gc("dictionary_path", "")))
+
+        buttons_layout = QHBoxLayout()
+        buttons_layout.addWidget(self.upsert_checkbox)
+        buttons_layout.addWidget(self.dictionary_checkbox)
+        buttons_layout.addWidget(self.check_button)
+        buttons_layout.addWidget(self.submit_button, 1)
+
         layout.addWidget(self.model_widget)
         layout.addWidget(self.deck_widget)
         layout.addWidget(tags_widget)
         layout.addWidget(info_label)
         layout.addWidget(self.processor_widget)
         layout.addWidget(self.text_edit)
-        layout.addWidget(self.submit_button)
+        layout.addLayout(buttons_layout)
+
+        # Debounced draft saving
+        self.save_draft_enabled = gc("save_draft", True)
+        self.draft_timer = QTimer(self)
+        self.draft_timer.setSingleShot(True)
+        self.draft_timer.setInterval(DRAFT_SAVE_DELAY_MS)
+        self.draft_timer.timeout.connect(self.save_draft)
+        self.text_edit.textChanged.connect(self.on_text_changed)
 
         self.setLayout(layout)
         self.setWindowTitle("MassAdd")
@@ -198,10 +297,47 @@ class MassAddWindow(QDialog):
     def show_window(self):
         if self.submit_button is None:
             self.setup_ui()
-        self.text_edit.setText("")
+            if self.save_draft_enabled:
+                # Restore the draft left over from the last session
+                self.text_edit.setPlainText(self.load_draft())
+        elif not self.save_draft_enabled:
+            self.text_edit.setText("")
         # Don't clear tags - keep them for multiple additions
         self.show()
 
+    def on_text_changed(self):
+        """Restart the draft save countdown"""
+        if self.save_draft_enabled:
+            self.draft_timer.start()
+
+    def load_draft(self) -> str:
+        """Read the saved draft, starting empty if it can't be read"""
+        try:
+            return self.draft_store.load()
+        except (OSError, ValueError):
+            return ""
+
+    def save_draft(self):
+        """Write the changed part of the text to the draft"""
+        if not self.save_draft_enabled:
+            return
+        try:
+            self.draft_store.save(self.text_edit.toPlainText())
+        except (OSError, ValueError):
+            # Don't complain on every pause in typing
+            self.save_draft_enabled = False
+            tooltip("Could not save the MassAdd draft. Autosave is off until Anki restarts.")
+
+    def flush_draft(self):
+        """Save a pending draft right away"""
+        if self.draft_timer is not None and self.draft_timer.isActive():
+            self.draft_timer.stop()
+            self.save_draft()
+
+    def hideEvent(self, event):
+        self.flush_draft()
+        super().hideEvent(event)
+
     def split_text(self):
         text = self.text_edit.toPlainText()
         split_marker = self.processor_text.text()
@@ -241,6 +377,32 @@ class MassAddWindow(QDialog):
                 from aqt.utils import tooltip
                 tooltip(f"Added {len(selected_tags)} tag(s)")
 
+    def check_current_sentences(self):
+        """Validate the current text without writing anything"""
+        from . import validation
+
+        model_id = self.model_chooser.selected_notetype_id
+        if not model_id:
+            showInfo("Please select a note type.")
+            return
+
+        m = mw.col.models.get(model_id)
+        if not m or not m["flds"]:
+            showInfo("Selected note type has no fields.")
+            return
+
+        tag_string = self.tags_edit.text().strip()
+        tags = mw.col.tags.split(tag_string) if tag_string else []
+
+        report = validation.validate_text(
+            self.text_edit.toPlainText(),
+            len(m["flds"]),
+            tags,
+            gc("max_field_length", 0),
+            cloze_field_indices(m),
+        )
+        showInfo(report.summary(), parent=self, textFormat="plain")
+
     def add_current_sentences(self):
         deck_id = self.deck_chooser.selectedId()
         model_id = self.model_chooser.selected_notetype_id
@@ -272,12 +434,18 @@ class MassAddWindow(QDialog):
             showInfo("No content to add.")
             return
 
-        # Add notes with progress indicator
-        mw.progress.start(label="Adding notes...", max=len(lines))
-        count = 0
-        added_note_ids: List[NoteId] = []
-        
-        for idx, line in enumerate(lines):
+        dictionary_index = None
+        if self.dictionary_checkbox.isChecked():
+            dictionary_index = self.get_dictionary()
+            if dictionary_index is None:
+                return
+
+        if self.upsert_checkbox.isChecked():
+            self.upsert_lines(m, deck_id, lines, tags, dictionary_index)
+            return
+
+        notes: List[Note] = []
+        for line in lines:
             # Split the line into values based on tabs
             values = line.split("\t")
             
@@ -294,7 +462,17 @@ class MassAddWindow(QDialog):
             
             # Add tags to the note
             note.tags = tags.copy()
-            
+            notes.append(note)
+
+        if dictionary_index is not None:
+            self.fill_from_dictionary(notes, dictionary_index)
+
+        # Add notes with progress indicator
+        mw.progress.start(label="Adding notes...", max=len(notes))
+        count = 0
+        added_note_ids: List[NoteId] = []
+        
+        for idx, note in enumerate(notes):
             note.note_type()["did"] = deck_id
             mw.col.addNote(note)
             added_note_ids.append(note.id)
@@ -307,11 +485,132 @@ class MassAddWindow(QDialog):
         mw.col.reset()
         
         showInfo(f"Added {count} note(s).")
+        self.finish_adding(added_note_ids)
+
+    def upsert_lines(self, m, deck_id, lines, tags, dictionary_index=None):
+        """Update notes matched by first field and add the rest as one undoable operation.
+
+        The notes are prepared here; writing them runs in the background as a
+        CollectionOp, so the browser and the undo menu pick up the changes.
+        """
+        col = mw.col
+        field_names = [fld["name"] for fld in m["flds"]]
+        rows = [line.split("\t") for line in lines]
+
+        mw.progress.start(label="Looking up existing notes...")
+        try:
+            existing = find_notes_by_first_field(m["id"], [values[0].strip() for values in rows])
+
+            add_requests: List[AddNoteRequest] = []
+            # New notes by first field, so repeated lines become one note
+            new_notes: Dict[str, Note] = {}
+            updated_notes: Dict[NoteId, Note] = {}
+            for values in rows:
+                key = first_field_key(values[0].strip())
+                nid = existing.get(key)
+                if nid is not None:
+                    note = updated_notes.get(nid)
+                    if note is None:
+                        note = col.get_note(nid)
+                        updated_notes[nid] = note
+                elif key in new_notes:
+                    note = new_notes[key]
+                else:
+                    note = Note(col, m)
+                    for i, field_name in enumerate(field_names):
+                        note[field_name] = values[i].strip() if i < len(values) else ""
+                    note.tags = tags.copy()
+                    add_requests.append(AddNoteRequest(note=note, deck_id=deck_id))
+                    # Blank first fields can't be matched, leave them separate
+                    if key:
+                        new_notes[key] = note
+                    continue
+
+                # A later line for the same note wins, but only for the
+                # fields the line actually provides
+                for i, field_name in enumerate(field_names[1:len(values)], 1):
+                    value = values[i].strip()
+                    if value:
+                        note[field_name] = value
+                for tag in tags:
+                    note.add_tag(tag)
+
+            if dictionary_index is not None:
+                mw.progress.update(label="Looking up words in dictionary...")
+                self.fill_from_dictionary(
+                    [request.note for request in add_requests] + list(updated_notes.values()),
+                    dictionary_index,
+                )
+        finally:
+            mw.progress.finish()
+
+        def write_notes(col):
+            undo_entry = col.add_custom_undo_entry("MassAdd")
+            try:
+                if add_requests:
+                    col.add_notes(add_requests)
+                if updated_notes:
+                    col.update_notes(list(updated_notes.values()))
+            except Exception:
+                # Whatever was written stays a single undo step
+                col.merge_undo_entries(undo_entry)
+                raise
+            return col.merge_undo_entries(undo_entry)
+
+        def on_success(changes):
+            added_note_ids = [request.note.id for request in add_requests]
+            showInfo(f"Added {len(added_note_ids)} note(s), updated {len(updated_notes)} note(s).")
+            self.finish_adding(added_note_ids + list(updated_notes))
+
+        def on_failure(error):
+            mw.update_undo_actions()
+            showInfo(f"Could not save the notes:\n{error}\n\n"
+                     "Anything already written can be reverted with Edit > Undo MassAdd.")
+
+        CollectionOp(parent=self, op=write_notes).success(on_success).failure(
+            on_failure
+        ).run_in_background()
+
+    def get_dictionary(self):
+        """Open the configured dictionary, indexing it first if it is new or changed"""
+        from . import dictionary
+
+        path = gc("dictionary_path", "")
+        if not path:
+            showInfo("No dictionary file is set. Choose one in the MassAdd configuration.")
+            return None
+
+        mw.progress.start(label="Loading dictionary...")
+        try:
+            self.dictionary = dictionary.open_dictionary(path, USER_FILES_DIR, self.dictionary)
+            error = None
+        except (OSError, ValueError) as e:
+            self.dictionary = None
+            error = e
+        finally:
+            mw.progress.finish()
+
+        if error is not None:
+            showInfo(f"Could not open dictionary:\n{error}")
+        return self.dictionary
+
+    def fill_from_dictionary(self, notes: List[Note], dictionary_index):
+        """Fill empty fields of the notes with one batched dictionary lookup"""
+        from . import dictionary
+        dictionary.fill_empty_fields([note.fields for note in notes], dictionary_index)
+
+    def finish_adding(self, note_ids: List[NoteId]):
+        """Clear the editor and apply the after-adding options"""
         self.text_edit.setText("")
+        self.draft_timer.stop()
+        try:
+            self.draft_store.clear()
+        except OSError:
+            pass
         
         # Show added notes in browser if enabled
-        if gc("show_added_notes", False) and added_note_ids:
-            self.show_notes_in_browser(added_note_ids)
+        if gc("show_added_notes", False) and note_ids:
+            self.show_notes_in_browser(note_ids)
         
         # Close window if enabled
         if gc("close_after_adding", False):
@@ -352,6 +651,7 @@ def add_massadd_action_to_main():
 # Initialize addon
 add_massadd_action_to_main()
 browser_will_show.append(add_massadd_action_to_browser)
+profile_will_close.append(MAWindow.flush_draft)
 
 
 # Add config dialog to Anki's add-ons menu
@@ -2,7 +2,7 @@
 """
 MassAdd Config Dialog
 """
-from aqt.qt import QDialog, QVBoxLayout, QHBoxLayout, QLabel, QCheckBox, QPushButton, QFrame, QGroupBox
+from aqt.qt import QDialog, QVBoxLayout, QHBoxLayout, QLabel, QCheckBox, QPushButton, QFrame, QGroupBox, QLineEdit, QFileDialog
 from aqt import mw
 from aqt.utils import tooltip
 
@@ -21,7 +21,10 @@ class MassAddConfigDialog(QDialog):
                 "show_added_notes": False,
                 "close_after_adding": False,
                 "recent_tags_limit": 10,
-                "recent_tags_search_depth": 100
+                "recent_tags_search_depth": 100,
+                "max_field_length": 100000,
+                "save_draft": True,
+                "dictionary_path": ""
             }
         
         self.show_in_main_window = config.get("show_in_main_window", True)
@@ -30,6 +33,9 @@ class MassAddConfigDialog(QDialog):
         self.close_after_adding = config.get("close_after_adding", False)
         self.recent_tags_limit = config.get("recent_tags_limit", 10)
         self.recent_tags_search_depth = config.get("recent_tags_search_depth", 100)
+        self.max_field_length = config.get("max_field_length", 100000)
+        self.save_draft = config.get("save_draft", True)
+        self.dictionary_path = config.get("dictionary_path", "")
         
         self.setWindowTitle("MassAdd Configuration")
         self.setMinimumWidth(450)
@@ -69,6 +75,24 @@ class MassAddConfigDialog(QDialog):
         self.close_window_checkbox.setChecked(self.close_after_adding)
         behavior_layout.addWidget(self.close_window_checkbox)
         
+        self.save_draft_checkbox = QCheckBox("Keep unsaved text as a draft between sessions")
+        self.save_draft_checkbox.setChecked(self.save_draft)
+        behavior_layout.addWidget(self.save_draft_checkbox)
+        
+        # Field length limit used by Check
+        from aqt.qt import QSpinBox
+        field_length_layout = QHBoxLayout()
+        field_length_label = QLabel("Check: max field length (0 = off):")
+        self.field_length_spinbox = QSpinBox()
+        self.field_length_spinbox.setMinimum(0)
+        self.field_length_spinbox.setMaximum(10000000)
+        self.field_length_spinbox.setSingleStep(1000)
+        self.field_length_spinbox.setValue(self.max_field_length)
+        field_length_layout.addWidget(field_length_label)
+        field_length_layout.addWidget(self.field_length_spinbox)
+        field_length_layout.addStretch()
+        behavior_layout.addLayout(field_length_layout)
+        
         behavior_group.setLayout(behavior_layout)
         layout.addWidget(behavior_group)
         
@@ -79,7 +103,6 @@ class MassAddConfigDialog(QDialog):
         layout.addWidget(separator2)
         
         # Recent Tags Settings
-        from aqt.qt import QSpinBox
         tags_group = QGroupBox("Recent Tags")
         tags_layout = QVBoxLayout()
         
@@ -110,9 +133,23 @@ class MassAddConfigDialog(QDialog):
         tags_group.setLayout(tags_layout)
         layout.addWidget(tags_group)
         
+        # Dictionary Settings
+        dictionary_group = QGroupBox("Dictionary")
+        dictionary_layout = QHBoxLayout()
+        
+        self.dictionary_path_edit = QLineEdit(self.dictionary_path)
+        self.dictionary_path_edit.setPlaceholderText("TSV file or StarDict .ifo file")
+        browse_button = QPushButton("Browse...")
+        browse_button.clicked.connect(self.browse_dictionary)
+        dictionary_layout.addWidget(self.dictionary_path_edit)
+        dictionary_layout.addWidget(browse_button)
+        
+        dictionary_group.setLayout(dictionary_layout)
+        layout.addWidget(dictionary_group)
+        
         # Info label
         info_label = QLabel(
-            "<i>Note: Menu location changes require restarting Anki</i>"
+            "<i>Note: Menu location and draft changes require restarting Anki</i>"
         )
         info_label.setWordWrap(True)
         layout.addWidget(info_label)
@@ -134,6 +171,17 @@ class MassAddConfigDialog(QDialog):
         
         self.setLayout(layout)
     
+    def browse_dictionary(self):
+        """Pick a dictionary file"""
+        path, _ = QFileDialog.getOpenFileName(
+            self,
+            "Choose Dictionary",
+            self.dictionary_path_edit.text(),
+            "Dictionaries (*.tsv *.txt *.ifo);;All files (*)",
+        )
+        if path:
+            self.dictionary_path_edit.setText(path)
+    
     def save_config(self):
         """Save configuration"""
         config = mw.addonManager.getConfig(__name__)
@@ -148,6 +196,9 @@ class MassAddConfigDialog(QDialog):
         config["close_after_adding"] = self.close_window_checkbox.isChecked()
         config["recent_tags_limit"] = self.tags_limit_spinbox.value()
         config["recent_tags_search_depth"] = self.search_depth_spinbox.value()
+        config["max_field_length"] = self.field_length_spinbox.value()
+        config["save_draft"] = self.save_draft_checkbox.isChecked()
+        config["dictionary_path"] = self.dictionary_path_edit.text().strip()
         
         mw.addonManager.writeConfig(__name__, config)
         
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+Local dictionary lookups for MassAdd
+
+A TSV or StarDict dictionary is converted once into a sorted index file in
+user_files. The index is memory-mapped and searched with binary search, so a
+lookup only touches the pages it needs instead of loading the dictionary.
+
+Index layout (little endian):
+    header   magic, source size, source mtime (ns), entry count, offsets position
+    records  uint32 key length, uint32 value length, key, value
+    offsets  one uint64 per entry, pointing at its record, sorted by key
+Keys are normalised UTF-8; values are the dictionary columns joined by \\x1f.
+Records are written in dictionary order while reading, so building the index
+only keeps the keys in memory, not the definitions.
+"""
+import glob
+import gzip
+import hashlib
+import mmap
+import os
+import struct
+import unicodedata
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from anki.utils import strip_html_media
+
+MAGIC = b"MADICT03"
+HEADER = struct.Struct("<8sQQQQ")
+OFFSET = struct.Struct("<Q")
+RECORD = struct.Struct("<II")
+COLUMN_SEPARATOR = "\x1f"
+
+
+def normalize_key(word: str) -> str:
+    """Lookup key for a word; matching ignores case and surrounding whitespace"""
+    return unicodedata.normalize("NFC", word.strip()).casefold()
+
+
+def index_path_for(source_path: str, index_folder: str) -> str:
+    digest = hashlib.sha1(os.path.abspath(source_path).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(index_folder, f"dictionary-{digest}.idx")
+
+
+def remove_other_indexes(index_path: str):
+    """Delete index files left behind by previously used dictionaries"""
+    pattern = os.path.join(os.path.dirname(index_path), "dictionary-*.idx*")
+    for path in glob.glob(pattern):
+        if path != index_path:
+            try:
+                os.remove(path)
+            except OSError:
+                # Still open elsewhere (Windows); try again next time
+                pass
+
+
+def _read_tsv(path: str) -> Iterator[Tuple[str, List[str]]]:
+    """word<TAB>column<TAB>column... one entry per line"""
+    with open(path, encoding="utf-8-sig", errors="replace") as f:
+        for line in f:
+            parts = line.rstrip("\r\n").split("\t")
+            if len(parts) > 1 and parts[0].strip():
+                yield parts[0], [part.strip() for part in parts[1:]]
+
+
+def _open_maybe_gzip(path: str):
+    for candidate in (path, path + ".gz", path + ".dz"):
+        if os.path.exists(candidate):
+            # .dz (dictzip) files are valid gzip streams
+            return gzip.open(candidate) if candidate != path else open(candidate, "rb")
+    raise ValueError(f"StarDict file not found: {path}")
+
+
+# Text types holding the meaning, and the type used when none of them is there.
+# Others, such as the phonetic "t" or the resource list "r", are never used.
+_MEANING_TYPES = "mhg"
+_FALLBACK_TYPES = "x"
+
+
+def _definition_part(data: bytes, sametypesequence: str) -> bytes:
+    """The meaning of a StarDict definition.
+
+    The first m (plain), h (HTML) or g (Pango) part is used, or else the first
+    x (XDXF) part. Lowercase types are NUL-terminated text, uppercase types are
+    binary data prefixed with a 32-bit size. With sametypesequence the type
+    characters are left out and the last part has no terminator or size.
+    """
+    fallback = b""
+    pos = 0
+    part = 0
+    while pos < len(data):
+        if sametypesequence:
+            if part >= len(sametypesequence):
+                break
+            kind = sametypesequence[part]
+            last = part == len(sametypesequence) - 1
+        else:
+            kind = chr(data[pos])
+            pos += 1
+            last = False
+        part += 1
+
+        if kind.islower():
+            end = len(data) if last else data.find(b"\0", pos)
+            if end < 0:
+                end = len(data)
+            if kind in _MEANING_TYPES:
+                return data[pos:end]
+            if kind in _FALLBACK_TYPES and not fallback:
+                fallback = data[pos:end]
+            pos = end + 1
+        else:
+            if last or pos + 4 > len(data):
+                break
+            pos += 4 + struct.unpack_from(">I", data, pos)[0]
+    return fallback
+
+
+def _read_stardict(ifo_path: str) -> Iterator[Tuple[str, List[str]]]:
+    """Entries of a StarDict dictionary given its .ifo file; one definition column"""
+    info = {}
+    with open(ifo_path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            key, sep, value = line.strip().partition("=")
+            if sep:
+                info[key] = value
+
+    base = ifo_path[:-len(".ifo")]
+    with _open_maybe_gzip(base + ".idx") as f:
+        idx_data = f.read()
+
+    entry = struct.Struct(">QI" if info.get("idxoffsetbits") == "64" else ">II")
+    positions = []
+    pos = 0
+    while pos < len(idx_data):
+        end = idx_data.find(b"\0", pos)
+        if end < 0:
+            raise ValueError(f"Truncated StarDict index: {base}.idx")
+        try:
+            offset, size = entry.unpack_from(idx_data, end + 1)
+        except struct.error:
+            raise ValueError(f"Truncated StarDict index: {base}.idx") from None
+        positions.append((offset, size, pos, end))
+        pos = end + 1 + entry.size
+
+    # Read definitions in file order so compressed .dz files are only ever
+    # decompressed forwards, a chunk at a time
+    positions.sort()
+    sametypesequence = info.get("sametypesequence", "")
+    with _open_maybe_gzip(base + ".dict") as f:
+        for offset, size, word_start, word_end in positions:
+            f.seek(offset)
+            data = _definition_part(f.read(size), sametypesequence)
+            definition = data.rstrip(b"\0").decode("utf-8", errors="replace").strip()
+            if definition:
+                word = idx_data[word_start:word_end].decode("utf-8", errors="replace")
+                yield word, [definition]
+
+
+def read_entries(source_path: str) -> Iterator[Tuple[str, List[str]]]:
+    if source_path.lower().endswith(".ifo"):
+        return _read_stardict(source_path)
+    return _read_tsv(source_path)
+
+
+def build_index(source_path: str, index_path: str):
+    """Write the dictionary entries as records, then a table sorting them by key"""
+    stat = os.stat(source_path)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, stat.st_size, stat.st_mtime_ns, 0, 0))
+
+        keys = []
+        offset = HEADER.size
+        for word, columns in read_entries(source_path):
+            key = normalize_key(word).encode("utf-8")
+            value = COLUMN_SEPARATOR.join(columns).encode("utf-8")
+            f.write(RECORD.pack(len(key), len(value)))
+            f.write(key)
+            f.write(value)
+            keys.append((key, offset))
+            offset += RECORD.size + len(key) + len(value)
+
+        # Stable sort, so the first entry of a repeated word wins below
+        keys.sort(key=lambda item: item[0])
+        count = 0
+        previous = None
+        for key, record_offset in keys:
+            if key != previous:
+                f.write(OFFSET.pack(record_offset))
+                count += 1
+                previous = key
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, stat.st_size, stat.st_mtime_ns, count, offset))
+    os.replace(tmp_path, index_path)
+    remove_other_indexes(index_path)
+
+
+class DictionaryIndex:
+    """Read-only, memory-mapped view of an index file."""
+
+    def __init__(self, source_path: str, index_path: str):
+        self.source_path = source_path
+        self.index_path = index_path
+        self._file = open(index_path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.source_size, self.source_mtime_ns,
+         self.count, self._offsets) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Not a MassAdd dictionary index: {index_path}")
+
+    def is_current(self, source_path: str) -> bool:
+        """Whether the index still matches the dictionary file it was built from"""
+        if source_path != self.source_path:
+            return False
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == (self.source_size, self.source_mtime_ns)
+
+    def _record(self, i: int) -> Tuple[int, int, int]:
+        offset = OFFSET.unpack_from(self._map, self._offsets + OFFSET.size * i)[0]
+        key_len, value_len = RECORD.unpack_from(self._map, offset)
+        return offset + RECORD.size, key_len, value_len
+
+    def _key(self, i: int) -> bytes:
+        start, key_len, _ = self._record(i)
+        return self._map[start:start + key_len]
+
+    def _value(self, i: int) -> List[str]:
+        start, key_len, value_len = self._record(i)
+        start += key_len
+        return self._map[start:start + value_len].decode("utf-8").split(COLUMN_SEPARATOR)
+
+    def lookup_many(self, words: Iterable[str]) -> Dict[str, List[str]]:
+        """Look up all words in one pass, returning the columns of each word found.
+
+        The keys are searched in sorted order, so each search gallops forward
+        from where the previous one ended and then bisects the final step.
+        """
+        by_key: Dict[bytes, List[str]] = {}
+        for word in words:
+            key = normalize_key(word)
+            if key:
+                by_key.setdefault(key.encode("utf-8"), []).append(word)
+
+        found: Dict[str, List[str]] = {}
+        lo = 0
+        for key in sorted(by_key):
+            step = 1
+            while lo + step < self.count and self._key(lo + step) < key:
+                lo += step
+                step *= 2
+            hi = min(lo + step, self.count)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._key(mid) < key:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo < self.count and self._key(lo) == key:
+                columns = self._value(lo)
+                for word in by_key[key]:
+                    found[word] = columns
+        return found
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def open_dictionary(source_path: str, index_folder: str,
+                    current: Optional[DictionaryIndex] = None) -> DictionaryIndex:
+    """Return an index for source_path, (re)building the index file when needed"""
+    if current is not None:
+        if current.is_current(source_path):
+            return current
+        current.close()
+
+    if not os.path.isfile(source_path):
+        raise ValueError(f"Dictionary file not found: {source_path}")
+
+    index_path = index_path_for(source_path, index_folder)
+    if os.path.exists(index_path):
+        try:
+            index = DictionaryIndex(source_path, index_path)
+        except (ValueError, struct.error):
+            index = None
+        if index is not None:
+            if index.is_current(source_path):
+                return index
+            index.close()
+
+    build_index(source_path, index_path)
+    return DictionaryIndex(source_path, index_path)
+
+
+def lookup_word(field: str) -> str:
+    """The word to look up for a field: NFC-normalized with HTML stripped"""
+    return strip_html_media(unicodedata.normalize("NFC", field)).strip()
+
+
+def fill_empty_fields(field_lists: List[List[str]], index: DictionaryIndex) -> int:
+    """Fill empty fields from the dictionary, keyed by the first field.
+
+    Dictionary column n goes into field n + 1. Returns how many field lists
+    were changed.
+    """
+    pending = []
+    for fields in field_lists:
+        if any(not value.strip() for value in fields[1:]):
+            word = lookup_word(fields[0])
+            if word:
+                pending.append((word, fields))
+    if not pending:
+        return 0
+
+    found = index.lookup_many(word for word, _ in pending)
+    changed = 0
+    for word, fields in pending:
+        columns = found.get(word)
+        if not columns:
+            continue
+        filled = False
+        for i, value in enumerate(columns[:len(fields) - 1], 1):
+            if value and not fields[i].strip():
+                fields[i] = value
+                filled = True
+        changed += filled
+    return changed
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Draft persistence for the MassAdd editor
+
+The draft is stored as a snapshot plus an append-only log of edits. Each save
+only appends the region that changed since the last save. The log is folded
+back into the snapshot once it grows larger than the snapshot, once replaying
+it would copy more than REPLAY_BUDGET characters, and after every load that
+replayed it.
+"""
+import json
+import os
+
+SNAPSHOT_NAME = "draft.txt"
+LOG_NAME = "draft.log"
+
+# Never compact a log smaller than this, so small drafts don't rewrite constantly
+MIN_COMPACT_SIZE = 64 * 1024
+
+# Replaying a record copies the whole draft, so cap records * draft length
+REPLAY_BUDGET = 64 * 1024 * 1024
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    """Length of the common prefix, found by binary search on slices"""
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def common_suffix_length(a: str, b: str, limit: int) -> int:
+    """Length of the common suffix, not reaching further back than limit characters"""
+    lo, hi = 0, min(len(a), len(b), limit)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:len(a) - lo] == b[len(b) - mid:len(b) - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+class DraftStore:
+    """Snapshot plus edit log kept in a folder (normally the add-on's user_files)."""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.snapshot_path = os.path.join(folder, SNAPSHOT_NAME)
+        self.log_path = os.path.join(folder, LOG_NAME)
+        self.saved_text = ""
+        self.snapshot_size = 0
+        self.log_size = 0
+        self.record_count = 0
+
+    def load(self) -> str:
+        """Rebuild the draft from the snapshot and replay the log"""
+        text = ""
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding="utf-8", errors="replace", newline="") as f:
+                text = f.read()
+        self.snapshot_size = len(text)
+        self.log_size = 0
+        self.record_count = 0
+
+        damaged = False
+        if os.path.exists(self.log_path):
+            with open(self.log_path, encoding="utf-8", errors="replace", newline="") as f:
+                for line in f:
+                    self.log_size += len(line)
+                    if not line.strip():
+                        continue
+                    try:
+                        start, end, replacement = json.loads(line)
+                    except (ValueError, TypeError):
+                        # A save interrupted halfway leaves a truncated record
+                        damaged = True
+                        break
+                    text = text[:start] + replacement + text[end:]
+                    self.record_count += 1
+
+        self.saved_text = text
+        if damaged or self.record_count:
+            # Start the session from a clean snapshot: the next load is a
+            # plain read, and later saves are never appended behind a
+            # broken record
+            try:
+                self.compact()
+            except OSError:
+                pass
+        return text
+
+    def save(self, text: str):
+        """Persist text, writing only what changed since the last save"""
+        old = self.saved_text
+        if text == old:
+            return
+
+        start = common_prefix_length(old, text)
+        suffix = common_suffix_length(old, text, min(len(old), len(text)) - start)
+        # Leading newline keeps a record off the end of an unterminated one
+        record = "\n" + json.dumps([start, len(old) - suffix, text[start:len(text) - suffix]],
+                                   ensure_ascii=False) + "\n"
+
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.log_path, "a", encoding="utf-8", newline="") as f:
+            f.write(record)
+        self.log_size += len(record)
+        self.record_count += 1
+        self.saved_text = text
+
+        if (self.log_size > max(self.snapshot_size, MIN_COMPACT_SIZE)
+                or self.record_count * len(text) > REPLAY_BUDGET):
+            self.compact()
+
+    def compact(self):
+        """Write the current draft as the new snapshot and drop the log"""
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+            f.write(self.saved_text)
+        os.replace(tmp_path, self.snapshot_path)
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        self.snapshot_size = len(self.saved_text)
+        self.log_size = 0
+        self.record_count = 0
+
+    def clear(self):
+        """Forget the draft"""
+        for path in (self.snapshot_path, self.log_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.saved_text = ""
+        self.snapshot_size = 0
+        self.log_size = 0
+        self.record_count = 0
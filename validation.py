@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Dry-run validation for MassAdd input
+"""
+import re
+from typing import Dict, List, Optional, Sequence
+
+from anki.utils import strip_html_media
+
+# How many line numbers to list per problem before summarising the rest
+MAX_REPORTED_LINES = 10
+
+# Characters Anki strips or replaces when it normalizes a tag
+_INVALID_TAG_CHARS = re.compile(r'["\x00-\x1f\x7f]')
+
+_CLOZE = re.compile(r"\{\{c\d+::")
+
+TOO_MANY_COLUMNS = "too_many_columns"
+LEADING_TAB = "leading_tab"
+EMPTY_FIRST_FIELD = "empty_first_field"
+MISSING_CLOZE = "missing_cloze"
+FIELD_TOO_LONG = "field_too_long"
+
+_PROBLEM_DESCRIPTIONS = {
+    TOO_MANY_COLUMNS: "More tab-separated columns than the note type has fields (extra columns would be dropped)",
+    LEADING_TAB: "Starts with a tab, so the first field is empty (the other columns would shift one field left)",
+    EMPTY_FIRST_FIELD: "First field is empty",
+    MISSING_CLOZE: "No cloze deletion ({{{{c1::...}}}}) in the cloze field",
+    FIELD_TOO_LONG: "A field is longer than {max_field_length} characters",
+}
+
+
+class ValidationReport:
+    """Problems found in a batch, keyed by problem kind."""
+
+    def __init__(self, line_count: int, max_field_length: int = 0):
+        self.line_count = line_count
+        self.max_field_length = max_field_length
+        self.problems: Dict[str, List[int]] = {}
+        self.invalid_tags: List[str] = []
+
+    def add(self, kind: str, line_no: int):
+        self.problems.setdefault(kind, []).append(line_no)
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems and not self.invalid_tags
+
+    def summary(self) -> str:
+        """Human readable summary of the report"""
+        if not self.line_count:
+            return "No content to check."
+        if self.ok:
+            return f"Checked {self.line_count} note(s). No problems found."
+
+        bad_lines = set()
+        for line_nos in self.problems.values():
+            bad_lines.update(line_nos)
+
+        parts = [f"Checked {self.line_count} note(s). "
+                 f"{len(bad_lines)} line(s) have problems."]
+        for kind, line_nos in self.problems.items():
+            description = _PROBLEM_DESCRIPTIONS[kind].format(
+                max_field_length=self.max_field_length)
+            shown = ", ".join(str(n) for n in line_nos[:MAX_REPORTED_LINES])
+            if len(line_nos) > MAX_REPORTED_LINES:
+                shown += f" and {len(line_nos) - MAX_REPORTED_LINES} more"
+            parts.append(f"\n{description}: {len(line_nos)} line(s)\n  Lines: {shown}")
+        if self.invalid_tags:
+            parts.append("\nTags that Anki will change: " + " ".join(self.invalid_tags))
+        return "\n".join(parts)
+
+
+def is_valid_tag(tag: str) -> bool:
+    """Whether Anki would keep the tag unchanged when normalizing it"""
+    if not tag or _INVALID_TAG_CHARS.search(tag):
+        return False
+    # Hierarchical tags may not have empty components ("a::", "::b", "a::::b")
+    return all(tag.split("::"))
+
+
+def validate_text(text: str, field_count: int, tags: List[str],
+                  max_field_length: Optional[int] = None,
+                  cloze_fields: Sequence[int] = ()) -> ValidationReport:
+    """Validate the whole batch in a single pass without creating notes.
+
+    Required fields are the first field, and for cloze note types the fields
+    in cloze_fields, at least one of which needs a cloze deletion. Other fields
+    may be empty.
+
+    Line numbers in the report refer to lines in the editor, counting blank
+    lines, so they can be found again easily.
+    """
+    max_field_length = max_field_length or 0
+    check_length = max_field_length > 0
+    report = ValidationReport(0, max_field_length)
+    line_count = 0
+
+    for line_no, raw_line in enumerate(text.split("\n"), 1):
+        line = raw_line.strip()
+        if not line:
+            continue
+        line_count += 1
+        values = line.split("\t")
+
+        # Adding strips the line, which silently drops a leading empty column
+        if raw_line.lstrip(" \r").startswith("\t"):
+            report.add(LEADING_TAB, line_no)
+
+        if len(values) > field_count:
+            report.add(TOO_MANY_COLUMNS, line_no)
+
+        first = values[0].strip()
+        # Only pay for HTML stripping when the field could be blank once rendered
+        if not first or ("<" in first or "&" in first) and not strip_html_media(first).strip():
+            report.add(EMPTY_FIRST_FIELD, line_no)
+
+        if cloze_fields and not any(
+            i < len(values) and _CLOZE.search(values[i]) for i in cloze_fields
+        ):
+            report.add(MISSING_CLOZE, line_no)
+
+        if check_length and len(line) > max_field_length:
+            if any(len(value.strip()) > max_field_length for value in values[:field_count]):
+                report.add(FIELD_TOO_LONG, line_no)
+
+    report.line_count = line_count
+    report.invalid_tags = [tag for tag in tags if not is_valid_tag(tag)]
+    return report